@@ -1,9 +1,16 @@
 import streamlit as st
-import json
+import asyncio
+import itertools
 import os
+import threading
+import time
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # AGNO IMPORTS
 from agno.agent import Agent
@@ -44,11 +51,18 @@ st.markdown('<p class="subtitle">Plan your dream trip with AI! Get personalized
 # -------------------------------------------------------
 # ENVIRONMENT VARIABLES
 # -------------------------------------------------------
-load_dotenv()
+@st.cache_resource
+def load_env():
+    # Read .env once per process rather than on every widget rerun
+    load_dotenv()
+    return os.getenv("SERPAPI_KEY"), os.getenv("OPENAI_API_KEY")
 
 # Ensure keys exist
-SERPAPI_KEY = os.getenv("SERPAPI_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+SERPAPI_KEY, OPENAI_API_KEY = load_env()
+
+if not SERPAPI_KEY or not OPENAI_API_KEY:
+    # Don't keep missing keys cached, so a fixed .env is picked up on the next rerun
+    load_env.clear()
 
 if not SERPAPI_KEY:
     st.error("⚠️ SERPAPI_KEY is missing. Please add it to your .env file.")
@@ -120,7 +134,25 @@ currency_converter = st.sidebar.checkbox("💱 Currency Exchange Rates")
 # -------------------------------------------------------
 # HELPER FUNCTIONS
 # -------------------------------------------------------
-def fetch_flights(source, destination, departure_date, return_date):
+SERPAPI_URL = "https://serpapi.com/search"
+
+@st.cache_resource
+def get_http() -> requests.Session:
+    # Shared keep-alive session; retries gateway errors but never a timed-out read
+    session = requests.Session()
+    retries = Retry(
+        total=2,
+        read=False,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+    return session
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def request_flights(source, destination, departure_date, return_date):
+    # Raises instead of returning {} so failed lookups are never cached
     params = {
         "engine": "google_flights",
         "departure_id": source,
@@ -131,13 +163,17 @@ def fetch_flights(source, destination, departure_date, return_date):
         "hl": "en",
         "api_key": SERPAPI_KEY
     }
+    response = get_http().get(SERPAPI_URL, params=params, timeout=(3.05, 10))
+    if response.status_code != 200:
+        raise requests.HTTPError(response=response)
+    return orjson.loads(response.content)
+
+def fetch_flights(source, destination, departure_date, return_date):
     try:
-        response = requests.get("https://serpapi.com/search", params=params)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Error fetching flight data: {response.status_code}")
-            return {}
+        return request_flights(source, destination, departure_date, return_date)
+    except requests.HTTPError as e:
+        st.error(f"Error fetching flight data: {e.response.status_code}")
+        return {}
     except Exception as e:
         st.error(f"An error occurred while fetching flights: {e}")
         return {}
@@ -150,47 +186,164 @@ def extract_cheapest_flights(flight_data):
     sorted_flights = sorted(best_flights, key=lambda x: x.get("price", float("inf")))[:3]
     return sorted_flights
 
+def compact_flights(flights):
+    # Keep only what the planner needs; the raw SerpAPI objects bloat the prompt
+    return [
+        {
+            "price": flight.get("price"),
+            "duration": flight.get("total_duration"),
+            "airline": next((leg.get("airline") for leg in flight.get("flights", [])), None),
+            "stops": max(len(flight.get("flights", [])) - 1, 0),
+        }
+        for flight in flights
+    ]
+
+def render_plan(flights, hotels, itinerary):
+    # itinerary is either the finished text or a stream of chunks; returns the full text
+    st.markdown("---")
+
+    st.subheader("✈️ Flight Options")
+    if flights:
+        st.json(flights)
+    else:
+        st.warning("No specific flight details found for these dates.")
+
+    st.subheader("🏨 Hotels & Dining")
+    st.write(hotels)
+
+    st.subheader("🗺️ Your Itinerary")
+    if isinstance(itinerary, str):
+        st.write(itinerary)
+    else:
+        # Show progress until the first chunk arrives, then stream the rest
+        with st.spinner("🗺️ Creating itinerary..."):
+            first_chunk = next(itinerary, "")
+        itinerary = st.write_stream(itertools.chain([first_chunk], itinerary))
+
+    st.success("✅ Travel plan generated successfully!")
+    return itinerary
+
+def run_in_thread(func, *args, **kwargs):
+    # Attach the Streamlit script context so st.* calls made from the worker thread still render
+    ctx = get_script_run_ctx()
+
+    def call():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args, **kwargs)
+
+    return asyncio.to_thread(call)
+
 # -------------------------------------------------------
 # AGENTS
 # -------------------------------------------------------
 
-# Researcher Agent
-researcher = Agent(
-    name="Researcher",
-    instructions=[
-        "Identify the travel destination specified by the user.",
-        "Gather detailed information on the destination, including climate, culture, and safety tips.",
-        "Find popular attractions, landmarks, and must-visit places.",
-        "Search for activities that match the user’s interests and travel style.",
-        "Provide structured summaries with key insights."
-    ],
-    model=OpenAIChat(id="gpt-4o"),
-    tools=[SerpApiTools(api_key=SERPAPI_KEY)],
-)
-
-# Planner Agent 
-planner = Agent(
-    name="Planner",
-    instructions=[
-        "Create a detailed day-by-day itinerary.",
-        "Optimize schedule based on user budget and preferences.",
-        "Estimate travel times and activity durations.",
-        "Provide a well-formatted final itinerary."
-    ],
-    model=OpenAIChat(id="gpt-4o"),
-)
+@st.cache_resource
+def get_agents():
+    # Built once per process instead of on every rerun
+
+    # Researcher Agent
+    researcher = Agent(
+        name="Researcher",
+        instructions=[
+            "Identify the travel destination specified by the user.",
+            "Gather detailed information on the destination, including climate, culture, and safety tips.",
+            "Find popular attractions, landmarks, and must-visit places.",
+            "Search for activities that match the user’s interests and travel style.",
+            "Provide structured summaries with key insights."
+        ],
+        model=OpenAIChat(id="gpt-4o"),
+        tools=[SerpApiTools(api_key=SERPAPI_KEY)],
+    )
+
+    # Planner Agent
+    planner = Agent(
+        name="Planner",
+        instructions=[
+            "Create a detailed day-by-day itinerary.",
+            "Optimize schedule based on user budget and preferences.",
+            "Estimate travel times and activity durations.",
+            "Provide a well-formatted final itinerary."
+        ],
+        model=OpenAIChat(id="gpt-4o"),
+    )
+
+    # Hotels & Restaurants Agent
+    hotel_restaurant_finder = Agent(
+        name="Hotel & Restaurant Finder",
+        instructions=[
+            "Search for top-rated hotels near major attractions.",
+            "Recommend restaurants matching user preferences.",
+            "Prioritize based on ratings, price, and distance."
+        ],
+        model=OpenAIChat(id="gpt-4o"),
+        tools=[SerpApiTools(api_key=SERPAPI_KEY)],
+    )
+
+    return {
+        "researcher": researcher,
+        "planner": planner,
+        "hotels": hotel_restaurant_finder,
+    }
 
-# Hotels & Restaurants Agent
-hotel_restaurant_finder = Agent(
-    name="Hotel & Restaurant Finder",
-    instructions=[
-        "Search for top-rated hotels near major attractions.",
-        "Recommend restaurants matching user preferences.",
-        "Prioritize based on ratings, price, and distance."
-    ],
-    model=OpenAIChat(id="gpt-4o"),
-    tools=[SerpApiTools(api_key=SERPAPI_KEY)],
-)
+agents = get_agents()
+researcher = agents["researcher"]
+planner = agents["planner"]
+hotel_restaurant_finder = agents["hotels"]
+
+@st.cache_resource
+def get_agent_loop() -> asyncio.AbstractEventLoop:
+    # One long-lived loop keeps the agents' shared async OpenAI clients bound to a live loop
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-loop", daemon=True).start()
+    return loop
+
+def run_agent(agent, prompt: str) -> str:
+    future = asyncio.run_coroutine_threadsafe(agent.arun(prompt, stream=False), get_agent_loop())
+    return future.result().content
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_researcher(prompt: str) -> str:
+    return run_agent(researcher, prompt)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_hotel_restaurant_finder(prompt: str) -> str:
+    return run_agent(hotel_restaurant_finder, prompt)
+
+ITINERARY_TTL = 3600
+ITINERARY_MAX_ENTRIES = 32
+
+@st.cache_resource
+def get_itinerary_cache():
+    # Streamed output can't go through st.cache_data, so finished itineraries are
+    # kept here by planning prompt as (timestamp, text); shared by every session
+    return {}, threading.Lock()
+
+def cached_itinerary(prompt: str):
+    cache, lock = get_itinerary_cache()
+    with lock:
+        entry = cache.get(prompt)
+    if entry and time.monotonic() - entry[0] < ITINERARY_TTL:
+        return entry[1]
+    return None
+
+def store_itinerary(prompt: str, text: str):
+    cache, lock = get_itinerary_cache()
+    now = time.monotonic()
+    with lock:
+        for key in [key for key, (stored_at, _) in cache.items() if now - stored_at >= ITINERARY_TTL]:
+            del cache[key]
+        cache.pop(prompt, None)
+        cache[prompt] = (now, text)
+        # Dicts keep insertion order, so the first key is the oldest entry
+        while len(cache) > ITINERARY_MAX_ENTRIES:
+            del cache[next(iter(cache))]
+
+def stream_planner(prompt: str):
+    # Yield itinerary text as it is generated; non-content events carry no text
+    for chunk in planner.run(prompt, stream=True):
+        content = getattr(chunk, "content", None)
+        if isinstance(content, str) and content:
+            yield content
 
 # -------------------------------------------------------
 # MAIN LOGIC
@@ -212,55 +365,62 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+plan_key = (
+    source, destination, departure_date, return_date, num_days,
+    travel_theme, activity_preferences, budget, hotel_rating,
+)
+
 if st.button("🚀 Generate Travel Plan"):
-    
-    # 1. Fetch Flights
-    with st.spinner("✈️ Fetching flights..."):
-        flight_data = fetch_flights(source, destination, departure_date, return_date)
-        cheapest_flights = extract_cheapest_flights(flight_data)
 
-    # 2. Research Attractions
-    with st.spinner("🔍 Researching attractions..."):
-        research_prompt = (
-            f"Research the best attractions and activities in {destination} "
-            f"for a {num_days}-day {travel_theme.lower()} trip. "
-            f"The traveler enjoys: {activity_preferences}. Budget: {budget}."
+    # Skip the SerpAPI round trip for an impossible date range
+    if return_date < departure_date:
+        st.error("⚠️ Return date cannot be earlier than the departure date.")
+        st.stop()
+
+    research_prompt = (
+        f"Research the best attractions and activities in {destination} "
+        f"for a {num_days}-day {travel_theme.lower()} trip. "
+        f"The traveler enjoys: {activity_preferences}. Budget: {budget}."
+    )
+    hotel_prompt = (
+        f"Find the best hotels and restaurants near attractions in {destination}. "
+        f"Preferences: {activity_preferences}, Budget: {budget}, Hotel Rating: {hotel_rating}."
+    )
+
+    # 1-3. Fetch Flights, Research Attractions and Find Hotels & Restaurants concurrently
+    async def gather_stage1():
+        return await asyncio.gather(
+            run_in_thread(fetch_flights, source, destination, departure_date, return_date),
+            run_in_thread(run_researcher, research_prompt),
+            run_in_thread(run_hotel_restaurant_finder, hotel_prompt),
         )
-        research_results = researcher.run(research_prompt, stream=False)
 
-    # 3. Find Hotels & Restaurants
-    with st.spinner("🏨 Finding hotels & restaurants..."):
-        hotel_prompt = (
-            f"Find the best hotels and restaurants near attractions in {destination}. "
-            f"Preferences: {activity_preferences}, Budget: {budget}, Hotel Rating: {hotel_rating}."
-        )
-        hotel_restaurant_results = hotel_restaurant_finder.run(hotel_prompt, stream=False)
-
-    # 4. Create Itinerary
-    with st.spinner("🗺️ Creating itinerary..."):
-        planning_prompt = (
-            f"Create a {num_days}-day itinerary for {destination}. "
-            f"Attractions: {research_results.content}. "
-            f"Hotels: {hotel_restaurant_results.content}. "
-            f"Flight options: {json.dumps(cheapest_flights)}."
-        )
-        itinerary = planner.run(planning_prompt, stream=False)
+    with st.spinner("✈️ Fetching flights, 🔍 researching attractions & 🏨 finding hotels..."):
+        flight_data, research_results, hotel_restaurant_results = asyncio.run(gather_stage1())
+        cheapest_flights = extract_cheapest_flights(flight_data)
 
-    # -------------------------------------------------------
-    # DISPLAY RESULTS
-    # -------------------------------------------------------
-    st.markdown("---")
-    
-    st.subheader("✈️ Flight Options")
-    if cheapest_flights:
-        st.json(cheapest_flights)
+    # 4. Create Itinerary, streamed straight into the page
+    planning_prompt = (
+        f"Create a {num_days}-day itinerary for {destination}. "
+        f"Attractions: {research_results}. "
+        f"Hotels: {hotel_restaurant_results}. "
+        f"Flight options: {orjson.dumps(compact_flights(cheapest_flights)).decode()}."
+    )
+    itinerary = cached_itinerary(planning_prompt)
+    if itinerary is None:
+        itinerary = render_plan(cheapest_flights, hotel_restaurant_results, stream_planner(planning_prompt))
+        store_itinerary(planning_prompt, itinerary)
     else:
-        st.warning("No specific flight details found for these dates.")
-
-    st.subheader("🏨 Hotels & Dining")
-    st.write(hotel_restaurant_results.content)
+        render_plan(cheapest_flights, hotel_restaurant_results, itinerary)
 
-    st.subheader("🗺️ Your Itinerary")
-    st.write(itinerary.content)
+    st.session_state["plan"] = {
+        "flights": cheapest_flights,
+        "hotels": hotel_restaurant_results,
+        "itinerary": itinerary,
+        "key": plan_key,
+    }
 
-    st.success("✅ Travel plan generated successfully!")
\ No newline at end of file
+# Redraw the last plan on reruns as long as the trip inputs are unchanged
+elif st.session_state.get("plan", {}).get("key") == plan_key:
+    plan = st.session_state["plan"]
+    render_plan(plan["flights"], plan["hotels"], plan["itinerary"])